@@ -0,0 +1,52 @@
+"""
+Chat REPL helpers
+=================
+Shared by both demos' chat loops: the exit words, and an input prompt that
+keeps the Ollama models loaded while it waits for the user.
+"""
+
+import asyncio
+
+import aioconsole
+import ollama
+from langchain_ollama import OllamaEmbeddings
+
+EXITS = frozenset({"exit", "quit"})
+KEEPALIVE_INTERVAL = 60  # seconds between load requests while waiting for input
+
+_clients = {}  # Ollama host → AsyncClient
+
+
+async def load_models(models):
+    """Ask Ollama to load each model (or reset its keep-alive timer) without generating anything."""
+    for model in models:
+        if model.base_url not in _clients:
+            _clients[model.base_url] = ollama.AsyncClient(host=model.base_url)
+        client = _clients[model.base_url]
+        try:
+            # An empty request only loads the model, leaving its cached prompt prefix alone
+            if isinstance(model, OllamaEmbeddings):
+                await client.embed(model=model.model, input=[], keep_alive=model.keep_alive)
+            else:
+                await client.chat(model=model.model, messages=[], keep_alive=model.keep_alive)
+        except Exception:
+            pass  # Ollama unreachable; the next real turn will report it
+
+
+async def _keep_loaded(models):
+    while True:
+        await load_models(models)
+        await asyncio.sleep(KEEPALIVE_INTERVAL)
+
+
+async def ainput(prompt: str, models) -> str:
+    """Read a line without blocking the event loop, keeping *models* loaded meanwhile.
+
+    Load requests only go out while waiting here, so they never compete with a
+    turn; the first prompt also warms the models at startup.
+    """
+    pinger = asyncio.create_task(_keep_loaded(models))
+    try:
+        return await aioconsole.ainput(prompt)
+    finally:
+        pinger.cancel()
@@ -1,20 +1,85 @@
+import asyncio
+import atexit
+import os
+import pickle
+import threading
 from typing import Annotated
 from typing_extensions import TypedDict
+import hnswlib
 from langgraph.graph import StateGraph
 from langgraph.graph.message import add_messages
-from langchain_ollama import ChatOllama
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+from chat_repl import EXITS, ainput
+from stream_printer import StreamPrinter
 class State(TypedDict):
     messages: Annotated[list[str], add_messages]
-graph_builder = StateGraph(State)
 
 llm=ChatOllama(
-    model="llama3.2:latest",
-    temperature=0
+    model="llama3.2:3b-instruct-q4_K_M",
+    temperature=0,
+    keep_alive="1h",
     )
 
+# Semantic cache: a prompt whose embedding is close enough to one already
+# answered reuses the stored reply instead of calling the LLM again.
+CACHE_PATH = "semantic_cache.pkl"
+CACHE_THRESHOLD = 0.95  # minimum cosine similarity for a cache hit
+EMBED_DIM = 768  # nomic-embed-text embedding size
+
+
+class CachedLLM:
+    """Wrap an LLM with a nearest-neighbour cache keyed by the last user message."""
+
+    def __init__(self, llm, embedder, path=CACHE_PATH, threshold=CACHE_THRESHOLD, dim=EMBED_DIM):
+        self.llm = llm
+        self.embedder = embedder
+        self.path = path
+        # hnswlib's cosine space reports distance as 1 - similarity
+        self.max_distance = 1 - threshold
+        self.lock = threading.Lock()
+        try:
+            with open(path, "rb") as f:
+                self.index, self.responses = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # No cache yet, or an unreadable one: start with an empty index
+            self.index = hnswlib.Index(space="cosine", dim=dim)
+            self.index.init_index(max_elements=1024)
+            self.responses = []
+
+    def invoke(self, messages):
+        emb = self.embedder.embed_query(messages[-1].content)
+        with self.lock:
+            if self.index.get_current_count():
+                labels, distances = self.index.knn_query([emb], k=1)
+                if distances[0][0] < self.max_distance:
+                    return self.responses[labels[0][0]]
+
+        response = self.llm.invoke(messages)
+
+        with self.lock:
+            if self.index.get_current_count() == self.index.get_max_elements():
+                self.index.resize_index(2 * self.index.get_max_elements())
+            self.index.add_items([emb], [len(self.responses)])
+            self.responses.append(response)
+        return response
+
+    def save(self):
+        # Write a temp file and swap it in, so an interrupted save leaves the old cache intact
+        tmp_path = self.path + ".tmp"
+        with self.lock:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((self.index, self.responses), f)
+            os.replace(tmp_path, self.path)
+
+
+embedder = OllamaEmbeddings(model="nomic-embed-text")
+cached_llm = CachedLLM(llm, embedder)
+atexit.register(cached_llm.save)
+
 def chatbot(state: State):
-    return {"messages": [llm.invoke(state["messages"])]}
+    return {"messages": [cached_llm.invoke(state["messages"])]}
 
+graph_builder = StateGraph(State)
 graph_builder.add_node("chatbot",chatbot)
 
 graph_builder.set_entry_point("chatbot")
@@ -33,10 +98,28 @@ graph=graph_builder.compile()
 #         f.write(mermaid_text)
 #     print("Saved Mermaid diagram text to graph.mmd — paste it at https://mermaid.live to view")
 
-while True:
-    user_input = input("You: ")
-    if user_input.lower() in {"exit", "quit"}:
-        break
-    for event in graph.stream({"messages": [("user", user_input)]}):
-        for value in event.values():
-            print("Assistant:",value['messages'][0].content)
+def run_batch(prompts: list[str], max_concurrency: int = 4) -> list[str]:
+    """Answer independent prompts concurrently so Ollama can batch them; returns the replies in order."""
+    results = graph.batch(
+        [{"messages": [("user", p)]} for p in prompts],
+        config={"max_concurrency": max_concurrency},
+    )
+    return [r["messages"][-1].content for r in results]
+
+async def main():
+    while True:
+        user_input = await ainput("You: ", (llm, embedder))
+        if user_input.strip().casefold() in EXITS:
+            break
+        with StreamPrinter() as out:
+            out.write("Assistant: ")
+            # "messages" mode yields tokens as the LLM produces them (or the whole
+            # reply at once on a semantic cache hit)
+            async for chunk, metadata in graph.astream({"messages": [("user", user_input)]}, stream_mode="messages"):
+                if metadata["langgraph_node"] == "chatbot":
+                    out.write(chunk.content)
+            out.write("\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
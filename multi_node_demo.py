@@ -8,13 +8,33 @@ This demo shows how to build a graph with:
 
 Flow:
   User Input → classifier → (joke | fact | advice | fallback) → END
+
+When no keyword pattern settles the intent, the classifier runs every handler
+speculatively while the LLM classifies, keeps the chosen reply, cancels the
+rest, and goes straight to END.
+
+Run with EMIT_GRAPH=1 to regenerate multi_node_graph.mmd after changing the graph.
 """
 
+import asyncio
+import os
+import re
+import threading
+from enum import Enum
+from types import MappingProxyType
 from typing import Annotated, Literal
+import httpx
+from pydantic import BaseModel, ValidationError
 from typing_extensions import TypedDict
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import AIMessage
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_ollama import ChatOllama
+from chat_repl import EXITS, ainput
+from stream_printer import StreamPrinter
 
 
 # ── State ────────────────────────────────────────────────────────────────
@@ -23,100 +43,219 @@ class State(TypedDict):
     intent: str  # stores the classified intent
 
 
+class Intent(str, Enum):
+    JOKE = "joke"
+    FACT = "fact"
+    ADVICE = "advice"
+    GENERAL = "general"
+
+
+class Classification(BaseModel):
+    """Schema the classifier LLM must answer with."""
+    intent: Intent
+
+
 # ── LLM ──────────────────────────────────────────────────────────────────
-llm = ChatOllama(model="llama3.2:latest", temperature=0)
-creative_llm = ChatOllama(model="llama3.2:latest", temperature=0.9)
+# Each node sends a fixed system prompt (the *_PROMPT templates below)
+# followed by the user turn; keeping the model loaded lets Ollama reuse the
+# KV cache for that shared prefix instead of re-prefilling it every call.
+# client_kwargs are forwarded to httpx. ChatOllama builds one sync client
+# (used by _classify, which runs in a worker thread) and one async client
+# (used by the handlers), each with its own keep-alive pool.
+llm = ChatOllama(
+    model="llama3.2:3b-instruct-q4_K_M",
+    temperature=0,
+    keep_alive="1h",
+    client_kwargs={"limits": httpx.Limits(max_keepalive_connections=8, keepalive_expiry=300)},
+)
+# model_copy keeps the already-built Ollama clients, so this shares llm's two pools
+creative_llm = llm.model_copy(update={"temperature": 0.9})
+# Picking one of four labels doesn't need the 3B model, so the classifier
+# runs on a much smaller one (same client; Ollama can keep both loaded).
+# Ollama constrains decoding to the Classification JSON schema, so the
+# reply is always a valid intent and needs no clean-up
+classifier_base_llm = llm.model_copy(update={"model": "qwen2.5:0.5b-instruct"})
+classifier_llm = classifier_base_llm.with_structured_output(Classification)
+
+
+# ── Helpers ──────────────────────────────────────────────────────────────
+def _last_text(state: State) -> str:
+    """Return the text of the latest message, whether it's a message object or a (role, text) tuple."""
+    msg = state["messages"][-1]
+    try:
+        return msg.content
+    except AttributeError:
+        return msg[1]
 
 
 # ── Node 1: Classifier ──────────────────────────────────────────────────
-def classifier(state: State) -> dict:
-    """Classify user intent into: joke, fact, advice, or general."""
-    last_msg = state["messages"][-1].content if hasattr(state["messages"][-1], "content") else state["messages"][-1][1]
-
-    classification_prompt = [
-        ("system",
-         "You are an intent classifier. Classify the user's message into EXACTLY one of these categories: "
-         "joke, fact, advice, general. "
-         "Reply with ONLY the single category word, nothing else."),
-        ("user", last_msg),
-    ]
-    response = llm.invoke(classification_prompt)
-    intent = response.content.strip().lower()
-
-    # Normalize to valid intents
-    if intent not in {"joke", "fact", "advice"}:
+CLASSIFIER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "You are an intent classifier. Classify the user's message into EXACTLY one of these categories: "
+     "joke, fact, advice, general. "
+     "Put the category in the \"intent\" field of your JSON reply."),
+    ("user", "{text}"),
+])
+classifier_chain = CLASSIFIER_PROMPT | classifier_llm
+
+
+# Keyword patterns that settle the common phrasings without an LLM call;
+# checked in order, so the first match wins
+INTENT_PATTERNS = {
+    re.compile(r"\b(joke|funny|laugh)\b", re.I): "joke",
+    re.compile(r"\b(fact|did you know|tell me about)\b", re.I): "fact",
+    re.compile(r"\b(advice|should i|help me|recommend)\b", re.I): "advice",
+}
+
+
+# LLM-classified intents keyed by normalized text. A plain dict (rather than
+# lru_cache) so the classifier can check for a hit before speculating.
+_INTENT_CACHE = {}
+_INTENT_CACHE_SIZE = 4096
+_intent_cache_lock = threading.Lock()
+
+
+def _classify(text: str) -> str:
+    """Ask the LLM for the intent of *text* and remember it; the answer depends only on the text."""
+    try:
+        intent = classifier_chain.invoke({"text": text}).intent.value
+    except (OutputParserException, ValidationError):
+        # Anything the model says that doesn't fit the schema counts as general chat
         intent = "general"
 
+    with _intent_cache_lock:
+        if len(_INTENT_CACHE) >= _INTENT_CACHE_SIZE:
+            del _INTENT_CACHE[next(iter(_INTENT_CACHE))]  # evict the oldest entry
+        _INTENT_CACHE[text] = intent
+    return intent
+
+
+def _announce(intent: str):
+    """Report the intent, and tell the chat loop which handler's tokens to print."""
     print(f"  [Classifier] Detected intent: {intent}")
-    return {"intent": intent}
+    get_stream_writer()({"intent": intent})
+
+
+async def classifier(state: State) -> dict:
+    """Classify user intent into: joke, fact, advice, or general."""
+    last_msg = _last_text(state)
+
+    for pattern, label in INTENT_PATTERNS.items():
+        if pattern.search(last_msg):
+            _announce(label)
+            return {"intent": label}
+
+    # Normalize before the cache lookup so trivially different phrasings share an entry
+    text = last_msg.strip().lower()
+    intent = _INTENT_CACHE.get(text)
+    if intent is not None:
+        _announce(intent)
+        return {"intent": intent}
+
+    # The LLM classification is slow, so start every handler chain now and keep
+    # only the one it picks: the turn costs max(T_classify, T_handler).
+    # Handler chains are tagged with their node name, so the chat loop can
+    # still tell their streamed tokens apart while they run in here.
+    drafts = {node: asyncio.create_task(chain.ainvoke({"text": last_msg})) for node, chain in HANDLER_CHAINS.items()}
+    try:
+        # _classify uses the sync client, so run it off the loop
+        intent = await asyncio.to_thread(_classify, text)
+        _announce(intent)
+        reply = await drafts[_ROUTE_MAP.get(intent, "fallback")]
+    finally:
+        for task in drafts.values():
+            task.cancel()
+        # Collect the losers so an error one already hit isn't reported as never retrieved
+        await asyncio.gather(*drafts.values(), return_exceptions=True)
+    return {"intent": intent, "messages": [reply]}
 
 
 # ── Node 2: Joke Teller ─────────────────────────────────────────────────
-def joke_teller(state: State) -> dict:
-    """Tell a joke related to the user's message."""
-    last_msg = state["messages"][-1].content if hasattr(state["messages"][-1], "content") else state["messages"][-1][1]
+JOKE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a hilarious comedian. Tell a short, funny joke related to what the user said. Keep it clean and witty."),
+    ("user", "{text}"),
+])
+joke_chain = (JOKE_PROMPT | creative_llm).with_config(tags=["joke_teller"])
 
-    prompt = [
-        ("system", "You are a hilarious comedian. Tell a short, funny joke related to what the user said. Keep it clean and witty."),
-        ("user", last_msg),
-    ]
-    response = creative_llm.invoke(prompt)
+
+async def joke_teller(state: State) -> dict:
+    """Tell a joke related to the user's message."""
+    last_msg = _last_text(state)
     print("  [Joke Teller] Generating joke...")
+    response = await joke_chain.ainvoke({"text": last_msg})
     return {"messages": [response]}
 
 
 # ── Node 3: Fact Provider ───────────────────────────────────────────────
-def fact_provider(state: State) -> dict:
-    """Provide an interesting fact related to the user's message."""
-    last_msg = state["messages"][-1].content if hasattr(state["messages"][-1], "content") else state["messages"][-1][1]
+FACT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a knowledgeable encyclopedia. Provide a concise, fascinating fact related to the user's topic. Include a 'Did you know?' opener."),
+    ("user", "{text}"),
+])
+fact_chain = (FACT_PROMPT | llm).with_config(tags=["fact_provider"])
+
 
-    prompt = [
-        ("system", "You are a knowledgeable encyclopedia. Provide a concise, fascinating fact related to the user's topic. Include a 'Did you know?' opener."),
-        ("user", last_msg),
-    ]
-    response = llm.invoke(prompt)
+async def fact_provider(state: State) -> dict:
+    """Provide an interesting fact related to the user's message."""
+    last_msg = _last_text(state)
     print("  [Fact Provider] Looking up facts...")
+    response = await fact_chain.ainvoke({"text": last_msg})
     return {"messages": [response]}
 
 
 # ── Node 4: Advisor ─────────────────────────────────────────────────────
-def advisor(state: State) -> dict:
-    """Give helpful advice related to the user's message."""
-    last_msg = state["messages"][-1].content if hasattr(state["messages"][-1], "content") else state["messages"][-1][1]
+ADVISOR_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a wise and empathetic advisor. Give brief, actionable advice on the user's topic. Be supportive and practical."),
+    ("user", "{text}"),
+])
+advisor_chain = (ADVISOR_PROMPT | llm).with_config(tags=["advisor"])
 
-    prompt = [
-        ("system", "You are a wise and empathetic advisor. Give brief, actionable advice on the user's topic. Be supportive and practical."),
-        ("user", last_msg),
-    ]
-    response = llm.invoke(prompt)
+
+async def advisor(state: State) -> dict:
+    """Give helpful advice related to the user's message."""
+    last_msg = _last_text(state)
     print("  [Advisor] Preparing advice...")
+    response = await advisor_chain.ainvoke({"text": last_msg})
     return {"messages": [response]}
 
 
 # ── Node 5: Fallback / General Chat ─────────────────────────────────────
-def fallback(state: State) -> dict:
-    """Handle general conversation."""
-    last_msg = state["messages"][-1].content if hasattr(state["messages"][-1], "content") else state["messages"][-1][1]
+FALLBACK_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a friendly, helpful assistant. Respond conversationally to the user."),
+    ("user", "{text}"),
+])
+fallback_chain = (FALLBACK_PROMPT | llm).with_config(tags=["fallback"])
+
 
-    prompt = [
-        ("system", "You are a friendly, helpful assistant. Respond conversationally to the user."),
-        ("user", last_msg),
-    ]
-    response = llm.invoke(prompt)
+async def fallback(state: State) -> dict:
+    """Handle general conversation."""
+    last_msg = _last_text(state)
     print("  [General Chat] Responding...")
+    response = await fallback_chain.ainvoke({"text": last_msg})
     return {"messages": [response]}
 
 
+HANDLER_CHAINS = MappingProxyType({
+    "joke_teller": joke_chain,
+    "fact_provider": fact_chain,
+    "advisor": advisor_chain,
+    "fallback": fallback_chain,
+})
+
+
 # ── Router function (decides which node runs next) ──────────────────────
-def route_by_intent(state: State) -> Literal["joke_teller", "fact_provider", "advisor", "fallback"]:
+_ROUTE_MAP = MappingProxyType({
+    "joke": "joke_teller",
+    "fact": "fact_provider",
+    "advice": "advisor",
+})
+
+
+def route_by_intent(state: State) -> Literal["joke_teller", "fact_provider", "advisor", "fallback", "__end__"]:
     """Route to the appropriate node based on classified intent."""
-    intent = state.get("intent", "general")
-    route_map = {
-        "joke": "joke_teller",
-        "fact": "fact_provider",
-        "advice": "advisor",
-    }
-    return route_map.get(intent, "fallback")
+    # A speculative run already left the chosen handler's reply in the state
+    if isinstance(state["messages"][-1], AIMessage):
+        return END
+    return _ROUTE_MAP.get(state.get("intent", "general"), "fallback")
 
 
 # ── Build the graph ─────────────────────────────────────────────────────
@@ -132,7 +271,8 @@ graph_builder.add_node("fallback", fallback)
 # Set entry point
 graph_builder.set_entry_point("classifier")
 
-# Add conditional edges from classifier → appropriate handler
+# Add conditional edges from classifier → appropriate handler (or END
+# when the classifier already picked a speculative reply)
 graph_builder.add_conditional_edges(
     "classifier",
     route_by_intent,
@@ -141,6 +281,7 @@ graph_builder.add_conditional_edges(
         "fact_provider": "fact_provider",
         "advisor": "advisor",
         "fallback": "fallback",
+        END: END,
     },
 )
 
@@ -153,26 +294,73 @@ graph_builder.add_edge("fallback", END)
 # Compile
 graph = graph_builder.compile()
 
-# Save the graph diagram
-mermaid_text = graph.get_graph().draw_mermaid()
-with open("multi_node_graph.mmd", "w") as f:
-    f.write(mermaid_text)
-print("Graph diagram saved to multi_node_graph.mmd (paste at https://mermaid.live to view)\n")
+# Save the graph diagram only when it's missing or EMIT_GRAPH is set,
+# so normal startups skip the graph walk and file write
+if os.environ.get("EMIT_GRAPH") or not os.path.exists("multi_node_graph.mmd"):
+    mermaid_text = graph.get_graph().draw_mermaid()
+    with open("multi_node_graph.mmd", "w") as f:
+        f.write(mermaid_text)
+    print("Graph diagram saved to multi_node_graph.mmd (paste at https://mermaid.live to view)\n")
+
+
+# ── Batch API ────────────────────────────────────────────────────────────
+async def run_batch(prompts: list[str], max_concurrency: int = 4) -> list[str]:
+    """Run independent prompts through the graph concurrently; returns the replies in order."""
+    results = await graph.abatch(
+        [{"messages": [("user", p)], "intent": ""} for p in prompts],
+        config={"max_concurrency": max_concurrency},
+    )
+    return [r["messages"][-1].content for r in results]
+
 
 # ── Chat loop ────────────────────────────────────────────────────────────
-print("=" * 50)
-print("  Multi-Node LangGraph Chatbot")
-print("  Try: 'tell me a joke', 'give me a fact about space', 'I need advice on studying'")
-print("  Type 'exit' to quit")
-print("=" * 50)
-
-while True:
-    user_input = input("\nYou: ")
-    if user_input.lower() in {"exit", "quit"}:
-        print("Goodbye!")
-        break
-
-    for event in graph.stream({"messages": [("user", user_input)], "intent": ""}):
-        for node_name, value in event.items():
-            if "messages" in value:
-                print(f"\nAssistant: {value['messages'][-1].content}")
+async def main():
+    print("=" * 50)
+    print("  Multi-Node LangGraph Chatbot")
+    print("  Try: 'tell me a joke', 'give me a fact about space', 'I need advice on studying'")
+    print("  Type 'exit' to quit")
+    print("=" * 50)
+
+    while True:
+        user_input = await ainput("\nYou: ", (llm, classifier_base_llm))
+        if user_input.strip().casefold() in EXITS:
+            print("Goodbye!")
+            break
+
+        # Speculative handlers stream tokens before the classifier has decided
+        # which one wins, so hold them per handler until its intent event arrives.
+        chosen = None
+        pending = {}
+        replying = False
+        with StreamPrinter() as out:
+            async for mode, payload in graph.astream(
+                {"messages": [("user", user_input)], "intent": ""},
+                stream_mode=["custom", "messages"],
+            ):
+                if mode == "custom":
+                    chosen = _ROUTE_MAP.get(payload["intent"], "fallback")
+                    texts = pending.get(chosen, [])
+                    pending.clear()
+                else:
+                    chunk, metadata = payload
+                    node = next((tag for tag in metadata.get("tags", ()) if tag in HANDLER_CHAINS), None)
+                    if node is None:
+                        continue  # classifier output, not part of the reply
+                    if chosen is None:
+                        pending.setdefault(node, []).append(chunk.content)
+                        continue
+                    if node != chosen:
+                        continue
+                    texts = [chunk.content]
+
+                # Start the reply on its first token, after the nodes' progress lines
+                for text in texts:
+                    if not replying:
+                        out.write("\nAssistant: ")
+                        replying = True
+                    out.write(text)
+            out.write("\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
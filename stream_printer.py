@@ -0,0 +1,42 @@
+"""
+Buffered token printer
+======================
+Collects streamed tokens and writes them to stdout in batches, so a reply
+costs a handful of write/flush calls instead of one per token.
+"""
+
+import sys
+import time
+
+
+class StreamPrinter:
+    """Context manager that batches streamed text and flushes whatever is left on exit.
+
+    Buffered text is written once *max_chunks* pieces have piled up or
+    *interval* seconds have passed since the last flush.
+    """
+
+    def __init__(self, max_chunks: int = 16, interval: float = 0.02, stream=None):
+        self.max_chunks = max_chunks
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.buf = []
+        self.last_flush = time.monotonic()
+
+    def write(self, text: str):
+        self.buf.append(text)
+        if len(self.buf) >= self.max_chunks or time.monotonic() - self.last_flush > self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.buf:
+            self.stream.write("".join(self.buf))
+            self.buf.clear()
+        self.stream.flush()
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()